@@ -1,15 +1,80 @@
 #! python
 
 import asyncio
+import aiohttp
 from aiohttp import web
 from aiohttp_sse import sse_response
 import gzip
-import sseclient
-import requests
-from datetime import datetime
+import io
+import mmap
+import os
+import queue
+import threading
 import sys
+import time
 import json
+import logging
 import argparse
+import array
+import bisect
+import collections
+import operator
+
+# orjson is a lot faster than the stdlib on these huge payloads, but don't make it mandatory
+# Both helpers deal in bytes for dumps, and accept either bytes or str for loads
+try:
+	import orjson
+	json_loads = orjson.loads
+	json_dumps = orjson.dumps
+except ImportError:
+	json_loads = json.loads
+	def json_dumps(obj):
+		# Compact like orjson, so output is the same either way and there's less of it
+		return json.dumps(obj, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+
+# rapidgzip decompresses on every core, which helps a lot on multi-GB archives, but it's optional too
+try:
+	import rapidgzip
+except ImportError:
+	rapidgzip = None
+
+# Reads a gzipped file that might not be finished, like a recording that's still going or got killed partway
+# Running out early just reads as the end of the file, without losing anything that was readable before it
+class UnfinishedGzip(io.RawIOBase):
+	def __init__(self, raw, path):
+		self._raw = raw
+		self._path = path
+
+	def readable(self):
+		return True
+
+	def readinto(self, b):
+		# One read at a time, so nothing gets thrown away in a buffer if this is the one that runs out
+		try:
+			data = self._raw.read1(len(b))
+		except EOFError:
+			log.warning(f"{TColors.RED2}%s ends without finishing, it may still be recording{TColors.END}", self._path)
+			return 0
+		b[:len(data)] = data
+		return len(data)
+
+	def close(self):
+		self._raw.close()
+		super().close()
+
+# Opens a gzipped file for reading binary lines through a nice big buffer
+def open_gzip(path, unfinished=False):
+	if rapidgzip:
+		raw = rapidgzip.open(path, parallelization=os.cpu_count())
+	else:
+		raw = gzip.open(path, mode='rb')
+	if unfinished:
+		raw = UnfinishedGzip(raw, path)
+	return io.BufferedReader(raw, buffer_size=128 * 1024)
+
+# Builds a ready to send eventSource frame out of a serialized payload
+def sse_frame(payload_bytes):
+	return b'data: ' + payload_bytes + b'\r\n\r\n'
 
 # Gotta look pretty on the command line
 class TColors:
@@ -32,6 +97,68 @@ class TColors:
 	BEIGE2  = '\33[96m'
 	WHITE2  = '\33[97m'
 
+# No point sending color codes anywhere but a terminal
+if not sys.stdout.isatty():
+	for name in [name for name in vars(TColors) if name.isupper()]:
+		setattr(TColors, name, '')
+
+# Status lines can come up for every message, so only put their templates together once
+# They're only filled in by logging if debug output is actually turned on
+STATUS_FORMAT = f"{TColors.BLUE2}%7.2f{TColors.END}: s%sd%s Ongoing:%s/%s Finished:%s/%s"
+HTTP_STATUS_FORMAT = f"{TColors.GREEN}HTTP: {TColors.BLUE}%7.2f{TColors.END}/%s\r"
+SSE_STATUS_FORMAT = f"{TColors.GREEN}SSE: {TColors.BLUE2}%7.2f/%s{TColors.END}\r"
+
+# The most SSE events that get sent to a client in one write when playback has fallen behind
+SSE_BATCH_SIZE = 32
+
+# How long (in seconds) one SSE client gets to take a write before it's dropped, so a slow one can't hold up everybody else
+SSE_WRITE_TIMEOUT = 10.0
+
+# How many messages back a recording looks for an identical payload, which gets written as a pointer instead
+# Payloads flip back and forth between the same states a lot, but only nearby, so players just keep this many around
+REPEAT_WINDOW = 64
+
+# Everything goes through here rather than print, so quiet runs skip the formatting entirely
+# Per-message status lines are debug level, everything else is info and up
+log = logging.getLogger("blaseball")
+
+# Status lines only need to keep up with somebody reading them, so they go out at most this often (in seconds)
+STATUS_INTERVAL = 1.0
+
+# Keeps track of when the last status line went out, on the monotonic clock so wall clock changes can't stall it
+class StatusGate:
+	def __init__(self, interval=STATUS_INTERVAL):
+		self.interval = interval
+		self.next_time = 0.0
+
+	# True if status lines are turned on and it's been long enough since the last one
+	def ready(self):
+		if not log.isEnabledFor(logging.DEBUG):
+			return False
+		now = time.monotonic()
+		if now < self.next_time:
+			return False
+		self.next_time = now + self.interval
+		return True
+
+# Keeps playback on schedule, using the loop's monotonic clock so wall clock changes can't mess with timing
+# The clock starts from wherever the queue is at, so seeking ahead or resuming picks up right away
+class PlaybackClock:
+	def __init__(self, messages, speed):
+		self.loop = asyncio.get_running_loop()
+		self.speed = speed
+		self.start_time = self.loop.time()
+		if not messages.is_empty():
+			self.start_time -= messages.top_timestamp() / speed
+
+	# How long until the message at this timestamp is due, negative if it's already late
+	def time_until(self, timestamp):
+		return self.start_time + timestamp / self.speed - self.loop.time()
+
+	# Sleeps until the message at this timestamp is due, or just lets everything else have a turn if it's already late
+	async def wait_for(self, timestamp):
+		await asyncio.sleep(max(self.time_until(timestamp), 0))
+
 # This is the game recording logic
 class BlaseballRecorder:
 	def __init__(self, filepath=None, uri=None):
@@ -42,33 +169,85 @@ class BlaseballRecorder:
 		self.day_mode = False
 		self.skip_days = 0
 
+		# Recordings are gzipped unless asked otherwise, uncompressed ones are bigger but faster to load
+		self.compress = True
+
 		# Internal state
-		self.messages = []
-		self.last_message = {}
+		self.last_hash = None
+		self.last_raw_hash = None
 		self.previous_day = -1
 		self.previous_season = -1
-		self.start_time = datetime.now()
+		self.start_time = 0.0
 
 		# Reconnection state
 		self.connect_attempts = 0
 
+		# Status line throttling
+		self.status_gate = StatusGate()
+
+		# Messages get written out as they come in rather than held until the end, so memory stays flat
+		# The file is only opened once there's a message to put in it
+		self.file = None
+		self.path = None
+		self.message_count = 0
+		self.skipping_day = False
+		self.recent_hashes = collections.deque(maxlen=REPEAT_WINDOW)
+
+	# This reads eventSource messages straight off the connection, yielding the raw data of each one
+	# Lines get split by hand since the payloads are way longer than aiohttp will allow for a single readline
+	# Everything stays as bytes the whole way through, ready to go straight into the json parser and the recording
+	async def events(self, response):
+		pending = []
+		data = []
+		async for chunk in response.content.iter_any():
+			*lines, rest = chunk.split(b'\n')
+			if lines:
+				# The first line finishes off whatever was left over from previous chunks
+				pending.append(lines[0])
+				lines[0] = b''.join(pending)
+				pending = []
+				for line in lines:
+					line = line.rstrip(b'\r')
+					if not line:
+						# A blank line means the event is complete
+						# Multiple data lines would normally be joined with newlines, but those can only be whitespace in json
+						# Leaving them out keeps each payload on a single line for the recording
+						if data:
+							yield b''.join(data)
+							data = []
+					elif line.startswith(b'data:'):
+						value = line[5:]
+						data.append(value[1:] if value.startswith(b' ') else value)
+			pending.append(rest)
+
 	# This is the main function for processing new events
-	async def listen(self, sse):
+	async def listen(self, events):
+		loop = asyncio.get_running_loop()
+
 		# Grab any new events that the eventStream has given us
-		for message in sse.events():
+		async for raw in events:
 			# If we've gotten an event we've successfully connected, so clear attempts
 			self.connect_attempts = 0
 
+			# An event that's byte for byte the same as the last one can't be new data, so don't even parse it
+			raw_hash = hash(raw)
+			if raw_hash == self.last_raw_hash:
+				continue
+			self.last_raw_hash = raw_hash
+
 			# Time upkeep
-			now = datetime.now()
+			now = loop.time()
 			time_since_start = now - self.start_time
 
 			# Grab the updated data
-			data = json.loads(message.data)
-			cut_data = data["value"]["games"].copy()
+			# The raw payload is kept around as-is for recording, so it never needs to be serialized again
+			data = json_loads(raw)
+			cut_data = data["value"]["games"]
 
 			# Only care about this message if it's new data
-			if cut_data != self.last_message:
+			# Comparing hashes of the games json is a lot cheaper than walking two huge dicts
+			cut_hash = hash(json_dumps(cut_data))
+			if cut_hash != self.last_hash:
 				# Grab season/day info
 				current_season = cut_data["sim"]["season"]
 				current_day = cut_data["sim"]["day"]
@@ -79,109 +258,154 @@ class BlaseballRecorder:
 						self.previous_day = current_day
 						self.previous_season = current_season
 					elif current_day > self.previous_day or current_season > self.previous_season:
-						# New day found! So write off what we've got and clear the recording data
-						print(f"Day change: s{self.previous_season}d{self.previous_day} -> s{current_season}d{current_day}")
-						self.write(self.messages)
+						# New day found! So finish off the file we've got, the next message will start a new one
+						# Flushing the last of the compressed file happens on a worker thread so the connection keeps getting read
+						log.info("Day change: s%sd%s -> s%sd%s", self.previous_season, self.previous_day, current_season, current_day)
+						await loop.run_in_executor(None, self.close)
 						self.previous_day = current_day
 						self.previous_season = current_season
-						self.messages = []
 						self.start_time = now
 
 						# New file means new 0.0 time
-						time_since_start = now - now
+						time_since_start = 0.0
 
-				# Set us up to check against the new cut_data, and add the full data to list
-				self.last_message = cut_data
-				self.messages.append((time_since_start.total_seconds(), data))
+				# Set us up to check against the new cut_data, and write the raw data out
+				# Compressing a big payload takes a moment, so that happens on a worker thread too (zlib lets go of the GIL while it works)
+				self.last_hash = cut_hash
+				await loop.run_in_executor(None, self.write, time_since_start, raw)
 
 				# Purely for display on the command line
-				total_games = 0
-				ongoing_games = 0
-				finished_games = 0
-				for game in cut_data["schedule"]:
-					total_games += 1
-					if game["gameComplete"]:
-						finished_games += 1
-					elif game["gameStart"]:
-						ongoing_games += 1
-				print(f"{TColors.BLUE2}{time_since_start.total_seconds():7.2f}{TColors.END}: s{current_season}d{current_day} Ongoing:{ongoing_games}/{total_games} Finished:{finished_games}/{total_games}")
+				if self.status_gate.ready():
+					# One pass over the schedule, counting each (gameComplete, gameStart) combination
+					schedule = cut_data["schedule"]
+					states = collections.Counter(map(operator.itemgetter("gameComplete", "gameStart"), schedule))
+					total_games = len(schedule)
+					finished_games = states[True, True] + states[True, False]
+					ongoing_games = states[False, True]
+					log.debug(STATUS_FORMAT, time_since_start, current_season, current_day, ongoing_games, total_games, finished_games, total_games)
 
 	# This is the main function for handling the connection
 	async def record(self):
 		# Make sure to note the time we start, so time-accurate playback is captured
-		self.start_time = datetime.now()
-
-		# Reconnect loop, 5 attempts chosen arbitrarily
-		while self.connect_attempts < 5:
-			try:
-				# requests.get opens the connection
-				response = requests.get(self.uri, stream=True)
-				# Create a client object from the connection
-				sse = sseclient.SSEClient(response)
-
-				# Await on this, which will process new messages indefiniately so long as the connection remains open
-				await asyncio.gather(self.listen(sse))
-				
-				# If we've hit this code, the connection has closed itself from the server without error
-				self.connect_attempts += 1
-				print(f"{TColors.RED2}Reconnecting {self.connect_attempts}/5...{TColors.END}")
-			except requests.exceptions.RequestException as e:
-				# If we're here, there's been an unclean issue with the connection
-				# Most of the time it's a chunk error, which I think means we've lost a packet of the pushed event?
-				print(f"{TColors.RED2}REQUEST EXCEPTION:{TColors.END} {e.__class__}, reconnecting after a delay")
-
-				# Do a longer delay each attempt to give things time to sort out
-				await asyncio.sleep(5 * self.connect_attempts)
-				self.connect_attempts += 1
-				print(f"{TColors.RED2}Reconnecting {self.connect_attempts}/5...{TColors.END}")
-
-		# If we've failed to reconnect, write and close
-		self.write(self.messages)
+		# This is the loop's monotonic clock, so wall clock changes can't mess with the timestamps
+		self.start_time = asyncio.get_running_loop().time()
+
+		# The stream never ends by itself, so only time out if the connection goes quiet for too long
+		timeout = aiohttp.ClientTimeout(total=None, sock_read=60)
+
+		# One session for every attempt, so reconnecting can reuse its pooled connection and DNS cache instead of starting from scratch
+		async with aiohttp.ClientSession(timeout=timeout) as session:
+			# Reconnect loop, 5 attempts chosen arbitrarily
+			while self.connect_attempts < 5:
+				try:
+					async with session.get(self.uri, headers={'Accept': 'text/event-stream'}) as response:
+						response.raise_for_status()
+
+						# Await on this, which will process new messages indefiniately so long as the connection remains open
+						await self.listen(self.events(response))
+
+					# If we've hit this code, the connection has closed itself from the server without error
+					self.connect_attempts += 1
+					log.warning(f"{TColors.RED2}Reconnecting %s/5...{TColors.END}", self.connect_attempts)
+				except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+					# If we're here, there's been an unclean issue with the connection
+					# Most of the time it's a chunk error, which I think means we've lost a packet of the pushed event?
+					log.warning(f"{TColors.RED2}REQUEST EXCEPTION:{TColors.END} %s, reconnecting after a delay", e.__class__)
+
+					# Do a longer delay each attempt to give things time to sort out
+					await asyncio.sleep(5 * self.connect_attempts)
+					self.connect_attempts += 1
+					log.warning(f"{TColors.RED2}Reconnecting %s/5...{TColors.END}", self.connect_attempts)
+
+		# If we've failed to reconnect, finish the file and close
+		self.close()
 		sys.exit(0)
 
-	# As the name suggets, this is the main function for writing our files out
-	def write(self, messages, error=False):
+	# Works out the filepath for the recording we're currently on
+	def recording_path(self, error=False):
 		path = self.filepath
 
 		# If we're in day mode, add the season/day to the filepath
 		if self.day_mode:
-			# Don't write the file if we didn't have a valid day or if we're skipping it
-			if self.previous_day < 0:
-				return
-			if self.skip_days > 0:
-				self.skip_days -= 1
-				print(f"{TColors.RED}Skipping day, {self.skip_days} skips remaining{TColors.END}")
-				return
 			path += f".s{self.previous_season}d{self.previous_day}"
 
-		# If we're in erorr mode, write an error dump so it won't clash with an actual file for the day
+		# If we're in erorr mode, make it an error dump so it won't clash with an actual file for the day
 		if error:
-			print(f"{TColors.RED}DUMPING DUE TO ERROR{TColors.END}")
 			path += ".errorDump"
 
 		# Original file format do not steal
-		path += ".stream"
+		# One [seconds, payload] json array per line, gzipped since the payloads compress really well
+		# A payload that's just an int means it's the same as the one that many lines back
+		return path + (".stream.gz" if self.compress else ".stream")
+
+	# Starts a new recording file, unless this is a day we've been asked to skip
+	def open_file(self):
+		self.message_count = 0
+		self.recent_hashes.clear()
+		if self.day_mode and self.skip_days > 0:
+			self.skip_days -= 1
+			self.skipping_day = True
+			log.info(f"{TColors.RED}Skipping day, %s skips remaining{TColors.END}", self.skip_days)
+			return
 
-		# Do the thing
-		if len(messages) < 1:
-			print(f"{TColors.RED}Skipping file write, no messages{TColors.END}")
+		self.path = self.recording_path()
+		self.file = gzip.open(self.path, 'wb', compresslevel=6) if self.compress else open(self.path, 'wb')
+
+	# As the name suggets, this is the main function for writing our messages out
+	def write(self, seconds, raw):
+		if self.file is None and not self.skipping_day:
+			self.open_file()
+		if self.file is None:
+			# This day is being skipped
 			return
-		file = open(path, 'w')
-		json.dump(messages, file)
-		print(f"{TColors.RED}Recorded {TColors.YELLOW2}{len(messages)}{TColors.RED} messages to {TColors.GREEN2}{path}{TColors.END}")
+
+		# If we've written this exact payload recently, just point back at it with how many lines ago it was
+		# Bytes cache their hash, so this doesn't cost anything on top of the check in listen
+		raw_hash = hash(raw)
+		for back, recent_hash in enumerate(reversed(self.recent_hashes), 1):
+			if recent_hash == raw_hash:
+				raw = b'%d' % back
+				break
+		self.recent_hashes.append(raw_hash)
+
+		# Payloads are raw as we received them, so just write them out around their timestamps
+		# They go in as separate pieces so a huge payload never gets copied into a new line first
+		self.file.writelines((b'[%r,' % seconds, raw, b']\n'))
+		self.message_count += 1
+
+	# Finishes off the current recording file
+	def close(self, error=False):
+		if self.skipping_day:
+			self.skipping_day = False
+			return
+		if self.file is None:
+			log.info(f"{TColors.RED}Skipping file write, no messages{TColors.END}")
+			return
+
+		self.file.close()
+		self.file = None
+
+		# If we're in erorr mode, move it to an error dump so it won't clash with an actual file for the day
+		path = self.path
+		if error:
+			log.error(f"{TColors.RED}DUMPING DUE TO ERROR{TColors.END}")
+			path = self.recording_path(error=True)
+			os.replace(self.path, path)
+
+		log.info(f"{TColors.RED}Recorded {TColors.YELLOW2}%s{TColors.RED} messages to {TColors.GREEN2}%s{TColors.END}", self.message_count, path)
 
 	# This is the entry point for actually recording stuff
 	def start(self):
 		try:
-			asyncio.get_event_loop().run_until_complete(self.record())
+			asyncio.run(self.record())
 		except KeyboardInterrupt:
 			# Make sure keyboard interrupts close us cleanly
-			self.write(self.messages)
+			self.close()
 			sys.exit(0)
 			return
-		except:
+		except Exception:
 			# All other unhandled issues are errors :(
-			self.write(self.messages, True)
+			self.close(True)
 			raise
 
 # This is the playback logic
@@ -189,63 +413,63 @@ class BlaseballStreamer:
 	def __init__(self, filepath=None, archive=False):
 		# Load up the given filepath
 		if not archive:
-			filepath = filepath or "blaseballGame.stream"
-			self.messages = FileQueue(filepath)
-			print(f"{TColors.RED}Loaded {TColors.YELLOW2}{len(self.messages)}{TColors.RED} messages from {TColors.GREEN2}{filepath}{TColors.RED}, last at {TColors.BLUE2}{self.messages.bottom()[0]:7.2f}{TColors.END}")
+			filepath = filepath or "blaseballGame.stream.gz"
+			self.messages = open_recording(filepath)
+			log.info(f"{TColors.RED}Loaded {TColors.GREEN2}%s{TColors.END}", filepath)
 		else:
 			# Load a compressed file from SIBR's s3 archives
 			self.messages = ArchiveQueue(filepath)
 		
 		# Default settings for playback
 		self.speed = 1.0
+		self.start_at = 0.0
 		self.http = False
 		self.sse = True
+		self.verbose = False
 
 		# Internals
 		self.webapp = web.Application()
-		self.http_games = []
-		self._sse_lock = False  # only one event stream can be open at a time due to mutable state in the playback queue.
+		self.http_games_json = b'[]'
+		self.sse_clients = {}
+		self._sse_playback = None
+		self._last_frame = None
+		self.status_gate = StatusGate()
+
+	# Works out how far the recording goes, for status lines
+	# Finding the end of a gzipped recording means reading through the whole thing first, so that's only done if asked for with -v
+	def describe_end(self):
+		if not self.verbose:
+			return "?"
+		return "%7.2f" % self.messages.bottom()[0]
 
 	# This holds the update logic for HTTP playback
 	# This will play back a stream in constant time, updating a cache of game data as it goes
 	# That will then be accessable from localhost:8080/games, as if using the blaseball /games api
 	async def start_http_playback(self):
 		# Setup variables
-		start_time = datetime.now()
-		last_message_body = {}
+		clock = PlaybackClock(self.messages, self.speed)
+		last_timestamp = self.describe_end()
 
-		print(f"{TColors.RED}Started HTTP playback{TColors.END}")
+		log.info(f"{TColors.RED}Started HTTP playback{TColors.END}")
 
 		# While we still have messages left to show...
 		while not self.messages.is_empty():
-			# Are we past the timestamp of the next message?
-			now = datetime.now()
-			time_since_start = now - start_time
-			seconds = time_since_start.total_seconds() * self.speed
-
-			if seconds >= self.messages.top()[0]:
-				# We are? Then update the current cache of what to show if somebody accesses the endpoint
-				print(f"{TColors.GREEN}HTTP: {TColors.BLUE}{self.messages.top()[0]:7.2f}{TColors.END}/{self.messages.bottom()[0]:7.2f}\r")
-				message = self.messages.top()[1]
-
-				if isinstance(message, int):
-					# If it's just an int, that means we have identical content to the previous message
-					# Was used when the stream included lastUpdateTime to indicate we got a message with a new lastUpdateTime that was identical
-					message = last_message_body
-				else:
-					last_message_body = message
+			timestamp, message = self.messages.top()
+			await clock.wait_for(timestamp)
 
-				# Grab the schedule, since that's the json we care about
-				self.http_games = message["value"]["games"]["schedule"]
+			# Update the current cache of what to show if somebody accesses the endpoint
+			if self.status_gate.ready():
+				log.debug(HTTP_STATUS_FORMAT, timestamp, last_timestamp)
 
-				# Advance
-				self.messages.pop()
-			else:
-				# If we're not to the next message's timestamp yet, sleep for a bit
-				await asyncio.sleep(0.05)
+			# Grab the schedule, since that's the json we care about
+			# It's serialized once here rather than for every request that comes in for it
+			self.http_games_json = json_dumps(message["value"]["games"]["schedule"])
+
+			# Advance
+			await self.messages.advance_async()
 
 		# We've hit the end of the stream
-		print(f"{TColors.RED}Finished HTTP playback{TColors.END}")
+		log.info(f"{TColors.RED}Finished HTTP playback{TColors.END}")
 
 	# This method starts the server
 	async def start_server(self, webapp):
@@ -259,62 +483,97 @@ class BlaseballStreamer:
 
 	# This method handles requests for /games
 	async def handle_http_games(self, request):
-		return web.json_response(self.http_games)
+		# Schedules are very repetitive json, so compress them for anybody who says they can take it
+		resp = web.Response(body=self.http_games_json, content_type='application/json')
+		resp.enable_compression()
+		return resp
+
+	# This holds the update logic for SSE playback
+	# Every connected client gets the same pre-built frames, so each message is only serialized once
+	async def start_sse_playback(self):
+		# Setup variables
+		clock = PlaybackClock(self.messages, self.speed)
+		last_timestamp = self.describe_end()
+
+		log.info(f"{TColors.RED}Started playback due to SSE connection{TColors.END}")
 
-	# This method handles requests for /streamData as an eventSource
-	async def handle_sse(self, request):
-		if self._sse_lock:
-			raise Exception('Only one open stream is currently supported.')
 		try:
-			self._sse_lock = True
-			# This sets up the eventSource stream
-			async with sse_response(request) as resp:
-				# Setup variables
-				start_time = datetime.now()
-				last_message_body = {}
-
-				print(f"{TColors.RED}Started playback due to SSE connection{TColors.END}")
-
-				# While we still have messages left to show...
-				while not self.messages.is_empty():
-					# Are we past the timestamp of the next message?
-					now = datetime.now()
-					time_since_start = now - start_time
-					seconds = time_since_start.total_seconds() * self.speed
-
-					if seconds >= self.messages.top()[0]:
-						# We are? Then send a new event
-						print(f"{TColors.GREEN}SSE: {TColors.BLUE2}{self.messages.top()[0]:7.2f}/{self.messages.bottom()[0]:7.2f}{TColors.END}\r")
-						message = self.messages.top()[1]
-
-						if isinstance(message, int):
-							# If it's just an int, that means we have identical content to the previous message
-							# Was used when the stream included lastUpdateTime to indicate we got a message with a new lastUpdateTime that was identical
-							message = last_message_body
-							message["value"]["lastUpdateTime"] = self.messages.top()[1]
-						else:
-							last_message_body = message
-
-						# Actually send the event
-						await resp.send(json.dumps(message))
-
-						# Advance
-						self.messages.pop()
-					else:
-						# If we're not to the next message's timestamp yet, sleep for a bit
-						await asyncio.sleep(0.05)
-
-				# We've hit the end of the stream
-				print(f"{TColors.RED}Finished SSE playback{TColors.END}")
-
-			# Close connection
-			return resp
+			# While we still have messages left to show and somebody to show them to...
+			while not self.messages.is_empty() and self.sse_clients:
+				await clock.wait_for(self.messages.top_timestamp())
+
+				# Everybody might have left while we were asleep, so hang onto the message for whoever comes back
+				if not self.sse_clients:
+					break
+
+				# Grab this message plus anything else that's already due, so a backlog goes out in one write
+				# They're still separate events to the client, just without a write per message
+				frames = []
+				while not self.messages.is_empty() and len(frames) < SSE_BATCH_SIZE:
+					timestamp = self.messages.top_timestamp()
+					if frames and clock.time_until(timestamp) > 0:
+						break
+					if self.status_gate.ready():
+						log.debug(SSE_STATUS_FORMAT, timestamp, last_timestamp)
+					frames.append(self.messages.top_frame())
+
+					# Advance
+					await self.messages.advance_async()
+				self._last_frame = frames[-1]
+
+				# Send the new events to everybody
+				batch = b''.join(frames)
+				clients = list(self.sse_clients)
+				results = await asyncio.gather(*(asyncio.wait_for(resp.write(batch), SSE_WRITE_TIMEOUT) for resp in clients), return_exceptions=True)
+
+				# Anybody we couldn't write to in time has gone away or can't keep up
+				for resp, result in zip(clients, results):
+					if isinstance(result, Exception):
+						self.release_sse_client(resp)
+		except Exception:
+			log.exception(f"{TColors.RED2}SSE playback failed{TColors.END}")
 		finally:
-			self._sse_lock = False
+			# Either we've hit the end of the stream, or everybody left and the next connection will pick back up from here
+			# Whoever is still connected gets let go either way, so nobody's left waiting on playback that isn't happening
+			self._sse_playback = None
+			for resp in list(self.sse_clients):
+				self.release_sse_client(resp)
+		if self.messages.is_empty():
+			log.info(f"{TColors.RED}Finished SSE playback{TColors.END}")
+
+	# Stops sending to a client, letting its request finish up
+	def release_sse_client(self, resp):
+		done = self.sse_clients.pop(resp, None)
+		if done is not None and not done.done():
+			done.set_result(None)
+
+	# This method handles requests for /streamData as an eventSource
+	async def handle_sse(self, request):
+		# This sets up the eventSource stream
+		# Tell any proxy in front of us not to hold onto events, or they'd arrive in clumps
+		async with sse_response(request, headers={'X-Accel-Buffering': 'no'}) as resp:
+			done = asyncio.get_running_loop().create_future()
+			self.sse_clients[resp] = done
+			try:
+				# Catch anybody joining late up on the latest state, reusing the frame that was already built
+				if self._last_frame is not None:
+					await asyncio.wait_for(resp.write(self._last_frame), SSE_WRITE_TIMEOUT)
+
+				# The first connection starts playback, anybody connecting after joins in wherever it's at
+				if self._sse_playback is None:
+					self._sse_playback = asyncio.ensure_future(self.start_sse_playback())
+
+				# Playback lets us know once it's done with us, so one client disconnecting doesn't touch it
+				await done
+			finally:
+				self.sse_clients.pop(resp, None)
+
+		# Close connection
+		return resp
 
 	# This method starts us up in http mode
 	async def start_http(self):
-		print(f"{TColors.BEIGE2}Starting stream in HTTP mode...{TColors.END}")
+		log.info(f"{TColors.BEIGE2}Starting stream in HTTP mode...{TColors.END}")
 		await asyncio.gather(
 			self.start_http_playback(),
 			self.start_server(self.webapp)
@@ -322,41 +581,60 @@ class BlaseballStreamer:
 
 	# This method starts us up in sse (aka eventSource) mode
 	async def start_sse(self):
-		print(f"{TColors.BEIGE2}Starting stream in SSE mode...{TColors.END}")
-		await asyncio.gather(
-			self.start_server(self.webapp)
-		)
+		log.info(f"{TColors.BEIGE2}Starting stream in SSE mode...{TColors.END}")
+		await self.start_server(self.webapp)
 
 	# Entry point
 	def start(self):
+		# Counting everything up can mean reading through the whole file too, so same deal
+		if self.verbose:
+			log.debug(f"{TColors.YELLOW2}%s{TColors.RED} messages, last at {TColors.BLUE2}%7.2f{TColors.END}", len(self.messages), self.messages.bottom()[0])
+
+		if self.start_at > 0:
+			self.messages.seek(self.start_at)
+			log.info(f"{TColors.RED}Skipped ahead to {TColors.BLUE2}%7.2f{TColors.END}", self.start_at)
+
 		try:
 			if self.http:
 				self.webapp.add_routes([web.get('/games', self.handle_http_games)])
-				asyncio.get_event_loop().run_until_complete(self.start_http())
+				asyncio.run(self.start_http())
 			elif self.sse:
 				self.webapp.add_routes([web.get('/streamData', self.handle_sse)])
-				asyncio.get_event_loop().run_until_complete(self.start_sse())
+				asyncio.run(self.start_sse())
 			else:
-				print(f"The birds prevent any streaming from happening. Check your options.")
+				log.error("The birds prevent any streaming from happening. Check your options.")
 		except KeyboardInterrupt:
-			print(f"{TColors.BEIGE2}Received interrupt, shutting down stream{TColors.END}")
+			log.info(f"{TColors.BEIGE2}Received interrupt, shutting down stream{TColors.END}")
 			sys.exit(0)
 
 
 class FileQueue:
 	"""
-	Simple deque abstraction to easily peek top and advance messages.
+	Simple cursor abstraction to easily peek top and advance messages.
+	Timestamps are kept in their own flat array, so seeking is just a binary search.
 	"""
 	def __init__(self, data):
-		with open(data or "blaseballGame.stream", "r") as f:
-			self._data = json.load(f)
-		self._original_len = len(self._data)
+		with open(data or "blaseballGame.stream", "rb") as f:
+			messages = json_loads(f.read())
+		self._timestamps = array.array('d', (message[0] for message in messages))
+		self._payloads = [message[1] for message in messages]
+		self._index = 0
+
+		# If a payload is just an int, that means we have identical content to the previous message
+		# Was used when the stream included lastUpdateTime to indicate we got a message with a new lastUpdateTime that was identical
+		# Fill those in once here with a copy of the previous payload, so playback never has to care
+		previous = None
+		for i, payload in enumerate(self._payloads):
+			if isinstance(payload, int):
+				self._payloads[i] = {**previous, "value": {**previous["value"], "lastUpdateTime": payload}}
+			else:
+				previous = payload
 
 	def is_empty(self):
 		"""
 		Returns True if we have reached the end of file.
 		"""
-		return not self._data
+		return self._index >= len(self._payloads)
 
 	def top(self):
 		"""
@@ -364,29 +642,304 @@ class FileQueue:
 		"""
 		if self.is_empty():
 			return None
-		return self._data[0]
+		return self._timestamps[self._index], self._payloads[self._index]
+
+	def top_timestamp(self):
+		"""
+		Returns just the next timedelta, without touching the payload.
+		"""
+		if self.is_empty():
+			return None
+		return self._timestamps[self._index]
 
 	def bottom(self):
 		"""
 		Returns the last (timedelta, payload) tuple.
 		"""
+		if not self._payloads:
+			return None
+		return self._timestamps[-1], self._payloads[-1]
+
+	def seek(self, seconds):
+		"""
+		Moves the queue to the first message at or after the given timedelta.
+		"""
+		self._index = bisect.bisect_left(self._timestamps, seconds)
+
+	def top_frame(self):
+		"""
+		Returns the next payload as a ready to send eventSource frame without advancing the queue.
+		"""
+		if self.is_empty():
+			return None
+		return sse_frame(json_dumps(self.top()[1]))
+
+	def advance(self):
+		"""
+		Moves on to the next message without returning anything.
+		"""
+		if not self.is_empty():
+			self._index += 1
+
+	async def advance_async(self):
+		"""
+		Same as advance, for playback to call so queues that might have to wait on the next message can let everything else run.
+		"""
+		self.advance()
+
+	def __len__(self):
+		"""
+		Return length of original log file.
+		"""
+		return len(self._timestamps)
+
+
+class StreamQueue(FileQueue):
+	"""
+	Reads a gzipped recording one line at a time, so we only ever hold and parse the
+	message that's up next instead of the whole file.
+	"""
+
+	def __init__(self, data):
+		# data is a file name
+		self._path = data
+		self._data = open_gzip(data, unfinished=True)
+		self._timestamps = None
+		self._recent = collections.deque(maxlen=REPEAT_WINDOW)
+		self._next_message()
+
+	def _scan_timestamps(self):
+		# Only go through the whole file for the timestamps once something needs them, so playback can start right away
+		if self._timestamps is None:
+			self._timestamps = array.array('d')
+			with open_gzip(self._path, unfinished=True) as f:
+				line = self._read_line(f)
+				while line:
+					self._timestamps.append(self._line_timestamp(line))
+					line = self._read_line(f)
+		return self._timestamps
+
+	def _read_line(self, f):
+		# A recording that's still going (or got killed partway) probably has half a line at the end
+		# That's just where the recording ends for now
+		line = f.readline()
+		if line and not line.endswith(b'\n'):
+			log.warning(f"{TColors.RED2}Ignoring cut off last line in %s{TColors.END}", self._path)
+			return b''
+		return line
+
+	def _line_timestamp(self, line):
+		# Lines always start with the timestamp, so there's no need to parse the whole payload
+		return float(line[1:line.index(b',')])
+
+	def _line_payload(self, line):
+		# The payload is still sitting in the line as it was recorded, so it can just be sliced out
+		line = line.rstrip()
+		return line[line.index(b',') + 1:-1]
+
+	def _next_message(self):
+		# Parsing waits until somebody actually asks for the message, eventSource playback never does
+		self._cur_line = self._read_line(self._data)
+		self._cur_message = None
+
+		# Repeated payloads point back at an earlier line, so hang onto the last few to look them up
+		self._cur_payload = self._line_payload(self._cur_line) if self._cur_line else None
+		if self._cur_payload and self._cur_payload[:1].isdigit():
+			self._cur_payload = self._recent[-int(self._cur_payload)]
+		self._recent.append(self._cur_payload)
+
+	def is_empty(self):
+		"""
+		Returns True if we have reached the end of file.
+		"""
+		return not self._cur_line
+
+	def top(self):
+		"""
+		Returns the next (timedelta, payload) tuple without advancing the queue.
+		"""
 		if self.is_empty():
 			return None
-		return self._data[-1]
+		if self._cur_message is None:
+			self._cur_message = self._line_timestamp(self._cur_line), json_loads(self._cur_payload)
+		return self._cur_message
 
-	def pop(self):
+	def top_timestamp(self):
 		"""
-		Returns the next (timedelta, payload) and advances the queue.
+		Returns just the next timedelta, without parsing the payload.
 		"""
 		if self.is_empty():
 			return None
-		return self._data.pop(0)
+		return self._line_timestamp(self._cur_line)
+
+	def bottom(self):
+		"""
+		Returns the last timedelta, without a payload since that would mean reading the whole file.
+		"""
+		timestamps = self._scan_timestamps()
+		if not timestamps:
+			return 0.0, None
+		return timestamps[-1], None
+
+	def seek(self, seconds):
+		"""
+		Moves the queue to the first message at or after the given timedelta.
+		"""
+		index = bisect.bisect_left(self._scan_timestamps(), seconds)
+		# Starting over from a fresh handle, since a recording that might not be finished can't be rewound
+		self._data.close()
+		self._data = open_gzip(self._path, unfinished=True)
+		self._recent.clear()
+		for _ in range(index):
+			self._next_message()
+		self._next_message()
+
+	def top_frame(self):
+		"""
+		Returns the next payload as a ready to send eventSource frame without advancing the queue.
+		"""
+		if self.is_empty():
+			return None
+		# Straight from the recording rather than serializing again
+		return sse_frame(self._cur_payload)
+
+	def advance(self):
+		"""
+		Moves on to the next message without returning anything.
+		"""
+		if not self.is_empty():
+			self._next_message()
 
 	def __len__(self):
 		"""
 		Return length of original log file.
 		"""
-		return self._original_len
+		return len(self._scan_timestamps())
+
+	def __del__(self):
+		"""
+		Close recording file on exit.
+		"""
+		if self._data:
+			self._data.close()
+
+
+class MappedQueue(StreamQueue):
+	"""
+	Memory maps an uncompressed recording and indexes where each line is, only parsing a
+	message once it's actually needed. Loading is near instant and the page cache does the rest.
+	"""
+
+	def __init__(self, data):
+		# data is a file name
+		# An empty file can't be mapped, which is what a recording looks like before its first write makes it to disk
+		# That just means there's nothing to play yet
+		self._data = None
+		with open(data, 'rb') as f:
+			if os.fstat(f.fileno()).st_size > 0:
+				self._data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+		# Find where every line's payload starts and ends, grabbing the timestamps while we're at it
+		self._starts = array.array('q')
+		self._ends = array.array('q')
+		self._timestamps = array.array('d')
+		start = 0
+		size = len(self._data) if self._data else 0
+		while start < size:
+			end = self._data.find(b'\n', start)
+			if end < 0:
+				# Every line gets a newline once it's done, so this one's still being written (or never will be)
+				log.warning(f"{TColors.RED2}Ignoring cut off last line in %s{TColors.END}", data)
+				break
+			if end > start:
+				comma = self._data.find(b',', start)
+				self._timestamps.append(float(self._data[start + 1:comma]))
+				payload_end = self._data.rfind(b']', comma, end)
+				if self._data[comma + 1:comma + 2].isdigit():
+					# Repeated payloads point back at an earlier line, so just reuse where that one is
+					back = int(self._data[comma + 1:payload_end])
+					self._starts.append(self._starts[-back])
+					self._ends.append(self._ends[-back])
+				else:
+					self._starts.append(comma + 1)
+					self._ends.append(payload_end)
+			start = end + 1
+
+		self._index = 0
+		self._cur_message = None
+
+	def _payload(self, index):
+		return self._data[self._starts[index]:self._ends[index]]
+
+	def is_empty(self):
+		"""
+		Returns True if we have reached the end of file.
+		"""
+		return self._index >= len(self._starts)
+
+	def top(self):
+		"""
+		Returns the next (timedelta, payload) tuple without advancing the queue.
+		"""
+		if self.is_empty():
+			return None
+		if self._cur_message is None:
+			self._cur_message = self._timestamps[self._index], json_loads(self._payload(self._index))
+		return self._cur_message
+
+	def top_timestamp(self):
+		"""
+		Returns just the next timedelta, without parsing the payload.
+		"""
+		if self.is_empty():
+			return None
+		return self._timestamps[self._index]
+
+	def bottom(self):
+		"""
+		Returns the last (timedelta, payload) tuple.
+		"""
+		if not self._starts:
+			return 0.0, None
+		return self._timestamps[-1], json_loads(self._payload(-1))
+
+	def seek(self, seconds):
+		"""
+		Moves the queue to the first message at or after the given timedelta.
+		"""
+		self._index = bisect.bisect_left(self._timestamps, seconds)
+		self._cur_message = None
+
+	def top_frame(self):
+		"""
+		Returns the next payload as a ready to send eventSource frame without advancing the queue.
+		"""
+		if self.is_empty():
+			return None
+		return sse_frame(self._payload(self._index))
+
+	def advance(self):
+		"""
+		Moves on to the next message without returning anything.
+		"""
+		if not self.is_empty():
+			self._index += 1
+			self._cur_message = None
+
+
+# Picks the right queue for a recording based on what's in the file
+def open_recording(filepath):
+	with open(filepath, 'rb') as f:
+		head = f.read(64)
+
+	if head.startswith(b'\x1f\x8b'):
+		# Gzipped json lines
+		return StreamQueue(filepath)
+	if head.lstrip()[1:].lstrip().startswith(b'['):
+		# Older recordings are one big json array of [seconds, payload] arrays
+		return FileQueue(filepath)
+	# Otherwise it's uncompressed json lines
+	return MappedQueue(filepath)
 
 
 class ArchiveQueue(FileQueue):
@@ -398,19 +951,60 @@ class ArchiveQueue(FileQueue):
 
 	def __init__(self, data):
 		# data is a file name
-		self._data = gzip.open(data, mode='rt', encoding='utf-8')
+		self._data = open_gzip(data)
+
+		# Decompressing and parsing happens on a background thread, which keeps a few messages ready to go
+		# That way playback isn't stuck waiting on zlib every time it needs the next message
+		# The thread only gets what it needs rather than all of us, so it can't keep us from getting cleaned up
+		self._prefetch = queue.Queue(maxsize=32)
+		self._stopped = threading.Event()
+		self._finished = False
+		threading.Thread(target=self._read_messages, args=(self._data, self._prefetch, self._stopped), daemon=True).start()
+
 		self._cur_message = self._next_message()
 		if not self._cur_message:
 			# idk how we got here
 			return
 		self._start_ts = self._message_timestamp(self._cur_message)
 
-	def _next_message(self):
+	@staticmethod
+	def _read_messages(data, prefetch, stopped):
+		# Waits for room in the queue, but gives up once the queue has been closed so the thread doesn't hang around
+		def put(item):
+			while not stopped.is_set():
+				try:
+					prefetch.put(item, timeout=1)
+					return True
+				except queue.Full:
+					pass
+			return False
+
+		# Lines stay as bytes, orjson is happy to parse them without decoding first
+		# A bad line or a cut off download still has to end the queue, so whatever went wrong gets passed along to be raised
+		error = None
 		try:
-			msg = next(self._data)
-			self._cur_message = {'value': {'games': json.loads(msg)}}
-		except StopIteration:
-			self._cur_message = None
+			for line in data:
+				line = line.rstrip()
+				if line and not put((line, {'value': {'games': json_loads(line)}})):
+					return
+		except BaseException as e:
+			error = e
+		finally:
+			put((None, error))
+
+	def _next_message(self):
+		if self._finished:
+			return None
+		return self._take_message(self._prefetch.get())
+
+	def _take_message(self, item):
+		self._cur_line, self._cur_message = item
+		if self._cur_line is None:
+			# That's the end of the file, or the reader thread ran into trouble
+			self._finished = True
+			error, self._cur_message = self._cur_message, None
+			if error is not None:
+				raise error
 		return self._cur_message
 
 	def _message_timestamp(self, msg):
@@ -430,19 +1024,54 @@ class ArchiveQueue(FileQueue):
 			return 0.0, None
 		return self._message_timestamp(self._cur_message) - self._start_ts, self._cur_message
 
+	def top_timestamp(self):
+		"""
+		Returns just the next timedelta.
+		"""
+		if self.is_empty():
+			return None
+		return self._message_timestamp(self._cur_message) - self._start_ts
+
 	def bottom(self):
 		"""
 		Dummy implementation so as not to break the log-based code.
 		"""
 		return 0.0, None
 
-	def pop(self):
+	def seek(self, seconds):
 		"""
-		Returns next (timedelta, payload) tuple and advances the queue.
+		Skips ahead to the first message at or after the given timedelta, archives can only be read forwards.
 		"""
-		next_message = self._cur_message
-		self._cur_message = self._next_message()
-		return self._message_timestamp(next_message) - self._start_ts, next_message
+		while not self.is_empty() and self.top_timestamp() < seconds:
+			self.advance()
+
+	def top_frame(self):
+		"""
+		Returns next payload as a ready to send eventSource frame without advancing the queue.
+		"""
+		if self.is_empty():
+			return None
+		# Wrap the line as it came out of the archive rather than serializing the parsed message again
+		return sse_frame(b'{"value":{"games":' + self._cur_line + b'}}')
+
+	def advance(self):
+		"""
+		Moves on to the next message without returning anything.
+		"""
+		if not self.is_empty():
+			self._next_message()
+
+	async def advance_async(self):
+		"""
+		Moves on to the next message, waiting on the reader thread off the event loop if it hasn't caught up yet.
+		"""
+		if self.is_empty():
+			return
+		try:
+			item = self._prefetch.get_nowait()
+		except queue.Empty:
+			item = await asyncio.get_running_loop().run_in_executor(None, self._prefetch.get)
+		self._take_message(item)
 
 	def __len__(self):
 		"""
@@ -454,6 +1083,7 @@ class ArchiveQueue(FileQueue):
 		"""
 		Close log file on exit.
 		"""
+		self._stopped.set()
 		if self._data:
 			self._data.close()
 
@@ -463,12 +1093,15 @@ def handle_record(args):
 	bbr = BlaseballRecorder(args.filepath, args.uri)
 	bbr.day_mode = args.day
 	bbr.skip_days = args.skipdays
+	bbr.compress = not args.uncompressed
 	bbr.start()
 
 # Handles starting us in stream mode form the command line arguments
 def handle_stream(args):
 	bbs = BlaseballStreamer(args.filepath, archive=args.archive)
 	bbs.speed = args.speed
+	bbs.start_at = args.start_at
+	bbs.verbose = args.verbose > 0
 
 	# You can only be one of these
 	bbs.http = args.http and not args.sse
@@ -487,6 +1120,8 @@ record_parser.add_argument("-f", "--file", dest="filepath", help="Path to save t
 record_parser.add_argument("--uri", help="URI to connect to using a websocket")
 record_parser.add_argument("--day", action="store_true", help="Appends the current season and day to the filename, and writes out the prevoius day to a file when the current day changes")
 record_parser.add_argument("--skipdays", type=int, default=0, help="Skip this number of days before starting to write day files. Useful with a value of 1 to not overwrite an existing day.")
+record_parser.add_argument("--uncompressed", action="store_true", help="Write plain .stream files instead of gzipped ones. They're a lot bigger, but load almost instantly for playback")
+record_parser.add_argument("-v", "--verbose", action="count", default=0, help="Log status lines (at most once a second) even when output isn't going to a terminal. Give it twice to include aiohttp's debug logging too")
 
 # Streaming mode subparser
 stream_parser = subparsers.add_parser("stream", help="Streams a given recording back to websocket or HTTP polling")
@@ -495,10 +1130,22 @@ stream_parser.add_argument("-f", "--file", dest="filepath", help="Path to read t
 stream_parser.add_argument("--http", action="store_true", help="Use HTTP playback to localhost:8080/game for polling implementations")
 stream_parser.add_argument("--sse", action="store_true", help="Use SSE playback to localhost:8080/streamGameData for SSE implementation. If neither this or --http is given, default to this")
 stream_parser.add_argument("--speed", type=float, default=1.0, help="Playback rate, as a float")
+stream_parser.add_argument("--start-at", dest="start_at", type=float, default=0.0, help="Start playback this many seconds into the recording")
+stream_parser.add_argument("-v", "--verbose", action="count", default=0, help="Log playback status lines (at most once a second) even when output isn't going to a terminal, along with how long the recording is. Give it twice to include aiohttp's debug logging too")
 stream_parser.add_argument("--archive", action="store_true", help="specified playback file is an archive file from SIBR.")
 
 args = parser.parse_args()
+
+# Status lines are on by default when somebody's watching from a terminal, or if asked for with -v
+handler = logging.StreamHandler(sys.stdout)
+handler.setFormatter(logging.Formatter("%(message)s"))
+log.addHandler(handler)
+log.propagate = False
+log.setLevel(logging.DEBUG if args.verbose or sys.stdout.isatty() else logging.INFO)
+if args.verbose > 1:
+	logging.basicConfig(level=logging.DEBUG)
+
 if args.func:
 	args.func(args)
 else:
-	print(f"The Umpire incinerated your command :(")
+	log.error("The Umpire incinerated your command :(")